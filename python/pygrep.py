@@ -12,69 +12,250 @@ useful subset of common features:
     - Backreferences: \1, \2, ...
     - Anchors: ^ (start of string), $ (end of string)
 
-Design Principles:
-    • Pedagogical clarity over optimization.
-    • Recursive generator-based backtracking matcher.
-    • Explicit handling of capture groups and quantifiers.
+How a match is dispatched:
+    1. Literals every match must contain are checked with C-level string
+       scans first, rejecting most lines before any matching.
+    2. By default the pattern is translated once into Python's `re`
+       syntax and matched by CPython's C engine. Patterns the translator
+       cannot express faithfully, or `use_re=False`, use the handcrafted
+       engine below, as do lines with non-ASCII numerals such as '½' when
+       the pattern uses \d or \w, which `re` classifies differently.
+    3. The handcrafted engine compiles the pattern into a small bytecode
+       program (after Cox). Patterns without backreferences run on a DFA
+       built lazily from it by subset construction, or on a linear-time
+       Thompson NFA simulation once the DFA grows too large.
+    4. Patterns with backreferences are specialized into generated Python
+       functions, one per pattern node, which backtrack with memoized
+       failures. The bytecode VM, which keeps an explicit stack, takes over
+       when the generated code exhausts Python's recursion limit.
+    5. Backtracking runs on a step budget. Past it, the NFA checks a
+       regular superset of the pattern, so hopeless inputs fail in linear
+       time; otherwise the search finishes unbudgeted.
 
 This code is written for academic demonstration and research-oriented projects.
 """
 
+import mmap
 import os
+import re
 import sys
+from array import array
+from collections import Counter, deque
+from itertools import chain, islice
 
 
 # ======================================================================
 #  Regex Engine
 # ======================================================================
 
+# Program opcodes (see MiniRegex._compile_program).
+(_CHAR, _CLASS, _GUARD, _JMP, _SPLIT, _SAVE, _BACKREF,
+ _MARK, _PROGRESS, _MATCH) = range(10)
+
+
+# Finds the non-ASCII characters of a line, the only ones on which `re`
+# and the handcrafted engine may classify \d and \w differently.
+_NON_ASCII = re.compile("[^\x00-\x7f]")
+
+
+class _BudgetExceeded(Exception):
+    """
+    Raised when a backtracking search runs out of steps.
+    """
+
+
 class MiniRegex:
     """
-    A handcrafted regex engine based on recursive backtracking.
+    A handcrafted regex engine based on backtracking over compiled bytecode.
 
     Attributes:
         pattern (str): Raw regex pattern provided by the user.
-        captures (list[str]): Captured substrings from groups.
+        captures (list[str]): Captured substrings from groups, as left by
+            the last successful match.
         num_groups (int): Total number of capturing groups detected.
+        required_bytes (list[bytes]): UTF-8 literals every match contains,
+            longest first, for prefiltering undecoded input.
+
+    When `use_re` is True (the default) the pattern is translated once into
+    an equivalent `re` pattern and matched by CPython's C engine. Patterns
+    the translator cannot express fall back to the backtracking matcher.
     """
 
-    def __init__(self, pattern: str):
+    # Lazily built DFAs larger than this are abandoned for the NFA.
+    DFA_MAX_STATES = 10000
+    # Backtracking searches get this many steps per character of text (and
+    # at least the minimum) before the NFA is consulted.
+    BACKTRACK_STEPS_PER_CHAR = 10
+    BACKTRACK_MIN_STEPS = 10000
+
+    def __init__(self, pattern: str, use_re: bool = True):
         self.pattern = pattern
-        self.captures = []
-        self.num_groups = self._count_groups(pattern)
+
+        # Everything that depends only on the pattern is computed once here
+        # rather than on every call to `matches`. A trailing '$' is only an
+        # anchor if it is not escaped by an odd run of backslashes.
+        self.anchored_start = pattern.startswith("^")
+        start, end = int(self.anchored_start), len(pattern)
+        if end > start and pattern[end - 1] == "$":
+            slash = end - 1
+            while slash > start and pattern[slash - 1] == "\\":
+                slash -= 1
+            if (end - 1 - slash) % 2 == 0:
+                end -= 1
+        self.anchored_end = end < len(pattern)
+        self._core = pattern[start:end]
+
+        self._compiled = self._compile_re(self._core) if use_re else None
+        try:
+            self._ast, self.num_groups = self._compile_ast(self._core)
+        except (ValueError, IndexError):
+            if self._compiled is None:
+                raise
+            # Only the `re` translation understands this pattern.
+            self._ast, self.num_groups = [], self._compiled.groups
+        self._root = 0 if self._ast else -1
+        self._required, self._prefix, self._suffix = self._compile_literals()
+        # U+FFFD may stand for undecodable bytes, so it cannot prefilter raw input.
+        self.required_bytes = [lit.encode("utf-8") for lit in self._required
+                               if "\ufffd" not in lit]
+        # Unanchored backtracking searches only try positions where the
+        # literal prefix occurs or whose character can begin a match.
+        self._lead = self._literal_prefix(self._ast, self._root)
+        self._first_set = self._first_table(self._ast, self._root)
+        backrefs = [node[1] for node in self._ast if node[0] == "backref"]
+        self.num_backrefs = len(backrefs)
+        # `re` takes \d to be the decimal digits, leaving out digits such
+        # as '²' that str.isdigit accepts, and lets \w match numerals such
+        # as '½'. Lines containing such characters go to the handcrafted
+        # engine, which is then built alongside the `re` pattern.
+        self._escape_gaps = (self._compiled is not None and
+                             any(node[0] == "escape" for node in self._ast))
+        handcrafted = self._compiled is None or self._escape_gaps
+
+        # Capture group g spans text[_cap[2g]:_cap[2g+1]]; -1 means unset.
+        # A backreference to a missing group reads a slot that stays unset.
+        # Loop registers used by _MARK/_PROGRESS follow the capture slots.
+        self._loop_base = 2 * max([self.num_groups] + backrefs)
+        self._loop_regs = 0
+        self._relaxing = None
+        self._prog = self._compile_program() if handcrafted else []
+        # A regular superset of a backtracking pattern, for budget overruns.
+        self._relaxed = (self._compile_program(relaxed=True)
+                         if handcrafted and self.num_backrefs else None)
+        self._budget = [0]
+        self._memo_ok = self._compile_memo_flags()
+        # DFA states are built on demand; _dfa_trans is None once abandoned.
+        self._dfa_ids, self._dfa_sets, self._dfa_accept = {}, [], []
+        self._dfa_trans = [] if handcrafted and not self.num_backrefs else None
+        self._fail = set()
+        self._cap_init = array("i", [-1]) * (self._loop_base + self._loop_regs)
+        self._cap = array("i", self._cap_init)
+        # `_undo` logs (slot, value) pairs overwritten during search.
+        self._undo = []
+        self._text = ""
+        # Set when the DFA or NFA accepted `_text` without recording groups.
+        self._replay = False
+        # Backtracking patterns also get a specialized Python matcher.
+        self._matches = (self._compile_codegen()
+                         if handcrafted and self.num_backrefs else None)
 
     # ------------------------------------------------------------------
-    #  Utility: Counting capture groups
+    #  Translation to Python's `re` syntax
     # ------------------------------------------------------------------
-    def _count_groups(self, pat: str) -> int:
+    def _compile_re(self, core: str):
         """
-        Count number of capturing groups, ignoring escaped parentheses.
+        Compile the `re` equivalent of the unanchored pattern `core`, or
+        return None if the pattern must be left to the handcrafted engine.
         """
-        count, i = 0, 0
-        while i < len(pat):
-            if pat[i] == "\\":
-                i += 2
-            elif pat[i] == "(":
-                count += 1
-                i += 1
-            else:
-                i += 1
-        return count
+        translated = self._translate(core)
+        if translated is None:
+            return None
+        try:
+            return re.compile(translated, re.DOTALL)
+        except re.error:
+            return None
 
-    # ------------------------------------------------------------------
-    #  Character classification utilities
-    # ------------------------------------------------------------------
-    @staticmethod
-    def is_digit(c: str) -> bool:
-        return c.isdigit()
+    def _translate(self, core: str):
+        """
+        Rewrite the supported subset as `re` syntax. Metacharacters that
+        this engine treats as literals (a top-level '|', a stray ')', a
+        leading quantifier, '{', inner anchors, ...) are escaped.
+        Returns None for constructs without a faithful translation.
+        """
+        out = ["^"] if self.anchored_start else []
+        depth, can_repeat, i = 0, False, 0
+        while i < len(core):
+            ch = core[i]
+            if ch == "\\":
+                if i + 1 >= len(core):
+                    return None
+                esc = core[i + 1]
+                if esc.isdigit():
+                    if esc not in "123456789":
+                        return None
+                    out.append(f"(?:\\{esc})")
+                elif esc in "dw":
+                    out.append("\\" + esc)
+                else:
+                    out.append(re.escape(esc))
+                can_repeat, i = True, i + 2
+                continue
 
-    @staticmethod
-    def is_alpha(c: str) -> bool:
-        return c.isalpha()
+            if ch == "[":
+                p, neg = i + 1, False
+                if p < len(core) and core[p] == "^":
+                    neg, p = True, p + 1
+                end = core.find("]", p)
+                if end < 0:
+                    return None
+                out.append(self._translate_class(core[p:end], neg))
+                can_repeat, i = True, end + 1
+                continue
+
+            if ch == "(":
+                depth += 1
+                out.append("(")
+                can_repeat = False
+            elif ch == ")" and depth:
+                depth -= 1
+                out.append(")")
+                can_repeat = True
+            elif ch == "|" and depth:
+                out.append("|")
+                can_repeat = False
+            elif ch in "?+*" and can_repeat:
+                out.append(ch)
+                can_repeat = False
+            elif ch == ".":
+                out.append(".")
+                can_repeat = True
+            else:
+                out.append(re.escape(ch))
+                can_repeat = True
+            i += 1
+
+        if self.anchored_end:
+            out.append("\\Z")
+        return "".join(out)
 
     @staticmethod
-    def is_underscore(c: str) -> bool:
-        return c == "_"
+    def _translate_class(class_expr: str, negated: bool) -> str:
+        """
+        Rewrite a class body using the same range rules as `_match_class`.
+        """
+        if not class_expr:
+            return "." if negated else "(?!)"
+        parts, i = ["[^" if negated else "["], 0
+        while i < len(class_expr):
+            if i + 2 < len(class_expr) and class_expr[i + 1] == "-":
+                parts.append(re.escape(class_expr[i]) + "-" +
+                             re.escape(class_expr[i + 2]))
+                i += 3
+            else:
+                parts.append(re.escape(class_expr[i]))
+                i += 1
+        parts.append("]")
+        return "".join(parts)
 
     # ------------------------------------------------------------------
     #  Character class matcher
@@ -101,14 +282,17 @@ class MiniRegex:
     # ------------------------------------------------------------------
     #  Pattern parsing utilities
     # ------------------------------------------------------------------
-    def _parse_atom(self, pat: str):
+    def _parse_atom(self, pat: str, p: int, end: int):
         """
-        Parse the next atomic element (literal, escape, class, wildcard).
-        Returns: (atom_type, atom_value, length_consumed, negated_flag)
+        Parse the atomic element at pat[p] (literal, escape, class, wildcard)
+        without reading past `end`.
+        Returns: (atom_type, atom_value, next_index, negated_flag)
         """
-        p, neg = 0, False
+        neg = False
         if pat[p] == "\\":
             p += 1
+            if p >= end:
+                raise ValueError("Trailing backslash in pattern")
             esc = pat[p]
             if esc.isdigit():
                 return "backref", int(esc), p + 1, neg
@@ -118,27 +302,27 @@ class MiniRegex:
 
         if pat[p] == "[":
             p += 1
-            if p < len(pat) and pat[p] == "^":
+            if p < end and pat[p] == "^":
                 neg = True
                 p += 1
             start = p
-            while p < len(pat) and pat[p] != "]":
+            while p < end and pat[p] != "]":
                 p += 1
-            if p >= len(pat):
+            if p >= end:
                 raise ValueError("Unterminated character class")
             return "class", pat[start:p], p + 1, neg
 
         if pat[p] == ".":
-            return "wildcard", ".", 1, neg
+            return "wildcard", ".", p + 1, neg
 
-        return "literal", pat[p], 1, neg
+        return "literal", pat[p], p + 1, neg
 
-    def _find_matching_paren(self, pat: str, start_idx: int) -> int:
+    def _find_matching_paren(self, pat: str, start_idx: int, end: int) -> int:
         """
         Find the matching ')' for the '(' at start_idx, accounting for nesting.
         """
         depth = 1
-        for i in range(start_idx + 1, len(pat)):
+        for i in range(start_idx + 1, end):
             if pat[i] == "(":
                 depth += 1
             elif pat[i] == ")":
@@ -147,185 +331,1034 @@ class MiniRegex:
                     return i
         raise ValueError("Missing closing parenthesis in pattern.")
 
-    def _split_alternatives(self, content: str) -> list[str]:
+    def _split_alternatives(self, pat: str, start: int, end: int) -> list:
         """
-        Split a group's content by top-level '|', ignoring nested groups.
+        Split pat[start:end] by top-level '|', ignoring nested groups.
+        Returns the (start, end) span of each alternative.
         """
-        parts, depth, last = [], 0, 0
-        for i, ch in enumerate(content):
+        spans, depth, last = [], 0, start
+        for i in range(start, end):
+            ch = pat[i]
             if ch == "(":
                 depth += 1
             elif ch == ")":
                 depth -= 1
             elif ch == "|" and depth == 0:
-                parts.append(content[last:i])
+                spans.append((last, i))
                 last = i + 1
-        parts.append(content[last:])
-        return parts
+        spans.append((last, end))
+        return spans
 
-    def _parse_expression(self, pat: str):
+    def _parse_expression(self, pat: str, p: int, end: int):
         """
-        Parse one logical expression: either a group or a single atom.
+        Parse one logical expression at pat[p]: either a group or an atom.
         """
-        if pat.startswith("("):
-            end_idx = self._find_matching_paren(pat, 0)
-            inner = pat[1:end_idx]
-            return "group", self._split_alternatives(inner), end_idx + 1, False
-        return self._parse_atom(pat)
+        if pat[p] == "(":
+            close = self._find_matching_paren(pat, p, end)
+            return "group", self._split_alternatives(pat, p + 1, close), close + 1, False
+        return self._parse_atom(pat, p, end)
 
     # ------------------------------------------------------------------
     #  Atom matcher factory
     # ------------------------------------------------------------------
     def _matcher_for(self, atom_type: str, atom_val, neg: bool):
+        """
+        Build the per-character predicate for an atom. Classes and escapes
+        answer ASCII characters with a single index into a precomputed
+        table and only fall back to the general test for other characters.
+        """
         if atom_type == "escape":
+            table = self._class_table(atom_type, atom_val, neg)
             if atom_val == "d":
-                return self.is_digit
-            if atom_val == "w":
-                return lambda c: (self.is_alpha(c) or
-                                  self.is_digit(c) or
-                                  self.is_underscore(c))
+                slow = str.isdigit
+            else:
+                slow = lambda c: c.isalpha() or c.isdigit() or c == "_"
+            return lambda c: table[ord(c)] if c < "\x80" else slow(c)
         if atom_type == "literal":
             return lambda c: c == atom_val
         if atom_type == "class":
-            return lambda c: self._match_class(c, atom_val, neg)
+            table = self._class_table(atom_type, atom_val, neg)
+            return lambda c: (table[ord(c)] if c < "\x80"
+                              else self._match_class(c, atom_val, neg))
         if atom_type == "wildcard":
             return lambda c: True
         return None
 
+    @staticmethod
+    def _class_table(atom_type: str, atom_val: str, neg: bool) -> bytes:
+        """
+        Precompute membership of all 128 ASCII characters for a class or
+        escape, using the same range rules as `_match_class`.
+        """
+        table = bytearray(128)
+        if atom_type == "escape":
+            table[0x30:0x3a] = b"\x01" * 10
+            if atom_val == "w":
+                table[0x41:0x5b] = b"\x01" * 26
+                table[0x61:0x7b] = b"\x01" * 26
+                table[0x5f] = 1
+            return bytes(table)
+
+        i = 0
+        while i < len(atom_val):
+            if i + 2 < len(atom_val) and atom_val[i + 1] == "-":
+                lo, hi = ord(atom_val[i]), min(ord(atom_val[i + 2]), 127)
+                if lo <= hi:
+                    table[lo:hi + 1] = b"\x01" * (hi - lo + 1)
+                i += 3
+            else:
+                if atom_val[i] < "\x80":
+                    table[ord(atom_val[i])] = 1
+                i += 1
+        if neg:
+            return bytes(1 - hit for hit in table)
+        return bytes(table)
+
     # ------------------------------------------------------------------
-    #  Recursive matching generator
+    #  AST compilation
     # ------------------------------------------------------------------
-    def _match_inner(self, text: str, pat: str, group_idx: int):
+    def _compile_ast(self, pat: str) -> tuple:
         """
-        Core recursive matcher. Yields (length_consumed, new_group_index).
+        Parse `pat` once into a flat list of nodes; return (ast, num_groups).
+
+        Each node is a tuple (atom_type, atom_val, quant, matcher, next_idx)
+        where `next_idx` is the index of the following node in the same
+        sequence, or -1 at the end of it. Group nodes carry
+        (group_number, alt_starts) as their value, with one start index per
+        alternative (-1 for an empty alternative), and class nodes carry
+        (class_expr, negated). Groups are numbered in order of their
+        opening parenthesis.
+
+        Alternatives are ordered by decreasing literal-prefix length so the
+        most selective branches are tried first, and a group whose every
+        alternative must start with a restricted character gets a
+        first-character predicate in its `matcher` slot.
         """
-        if not pat:
-            yield 0, group_idx
-            return
+        ast = []
+        self._group_counter = 0
+        self._compile_sequence(pat, 0, len(pat), ast)
 
-        expr_type, expr_val, consumed, neg = self._parse_expression(pat)
-        quant = pat[consumed] if consumed < len(
-            pat) and pat[consumed] in "+?*" else None
-        remainder = pat[consumed + (1 if quant else 0):]
-
-        # Handle groups
-        if expr_type == "group":
-            this_group = group_idx + 1
-            alts = expr_val
-
-            def match_group_once(inp, gidx):
-                for alt in alts:
-                    saved = list(self.captures)
-                    for alt_len, next_idx in self._match_inner(inp, alt, gidx):
-                        self.captures[this_group - 1] = inp[:alt_len]
-                        yield alt_len, next_idx
-                    self.captures = saved
-
-            if quant is None:
-                for mlen, idx in match_group_once(text, this_group):
-                    for rlen, r_idx in self._match_inner(text[mlen:], remainder, idx):
-                        yield mlen + rlen, r_idx
-                return
-
-            if quant == "?":
-                for mlen, idx in match_group_once(text, this_group):
-                    for rlen, r_idx in self._match_inner(text[mlen:], remainder, idx):
-                        yield mlen + rlen, r_idx
-                for rlen, r_idx in self._match_inner(text, remainder, group_idx):
-                    yield rlen, r_idx
-                return
+        for node in ast:
+            if node[0] != "group":
+                continue
+            group_no, alts = node[1]
+            alts = sorted(alts, key=lambda alt: -len(self._literal_prefix(ast, alt)))
+            node[1] = (group_no, tuple(alts))
+            guard = self._first_table(ast, alts, is_group=True)
+            if guard is not None and not all(guard):
+                node[3] = lambda c, guard=guard: c >= "\x80" or guard[ord(c)]
+        return [tuple(node) for node in ast], self._group_counter
 
+    @staticmethod
+    def _literal_prefix(ast: list, ni: int) -> str:
+        """
+        Return the literal text every match of sequence `ni` starts with.
+        """
+        prefix = []
+        while ni >= 0:
+            atom_type, atom_val, quant, _, nxt = ast[ni]
+            if atom_type != "literal" or quant not in (None, "+"):
+                break
+            prefix.append(atom_val)
             if quant == "+":
-                def plus_recurse(inp, gidx):
-                    for one_len, one_idx in match_group_once(inp, gidx):
-                        saved_caps = list(self.captures)
-                        for more_len, more_idx in plus_recurse(inp[one_len:], gidx):
-                            yield one_len + more_len, more_idx
-                        self.captures = saved_caps
-                        yield one_len, one_idx
-
-                for total_len, idx in plus_recurse(text, this_group):
-                    for rlen, r_idx in self._match_inner(text[total_len:], remainder, idx):
-                        yield total_len + rlen, r_idx
-                return
-
-        # Handle backreference
-        if expr_type == "backref":
-            ref = expr_val
-            if ref <= len(self.captures) and self.captures[ref - 1] is not None:
-                cap = self.captures[ref - 1]
-                if text.startswith(cap):
-                    for rlen, r_idx in self._match_inner(text[len(cap):], remainder, group_idx):
-                        yield len(cap) + rlen, r_idx
-            return
+                break
+            ni = nxt
+        return "".join(prefix)
 
-        # Handle single atom
-        matcher = self._matcher_for(expr_type, expr_val, neg)
+    def _first_table(self, ast: list, ni, is_group: bool = False):
+        """
+        Return a 128-entry table of the ASCII characters that can begin a
+        match of sequence `ni` (or of any alternative in `ni` when
+        `is_group`), or None if the first character is not restricted: the
+        sequence may match the empty string, or starts with a backreference.
+        Non-ASCII characters are never ruled out.
+        """
+        table = bytearray(128)
+        if is_group:
+            for alt in ni:
+                first = self._first_table(ast, alt)
+                if first is None:
+                    return None
+                for code in range(128):
+                    table[code] |= first[code]
+            return bytes(table)
 
-        if quant is None:
-            if text and matcher(text[0]):
-                for rlen, r_idx in self._match_inner(text[1:], remainder, group_idx):
-                    yield 1 + rlen, r_idx
-            return
+        while ni >= 0:
+            atom_type, atom_val, quant, matcher, nxt = ast[ni]
+            if atom_type == "backref":
+                return None
+            if atom_type == "group":
+                first = self._first_table(ast, atom_val[1], is_group=True)
+                if first is None:
+                    return None
+                for code in range(128):
+                    table[code] |= first[code]
+            else:
+                for code in range(128):
+                    if matcher(chr(code)):
+                        table[code] = 1
+            if quant not in ("?", "*"):
+                return bytes(table)
+            ni = nxt
+        return None
 
-        if quant == "+":
-            if not text or not matcher(text[0]):
-                return
-            reps = 1
-            while reps < len(text) and matcher(text[reps]):
-                reps += 1
-            for used in range(reps, 0, -1):
-                for rlen, r_idx in self._match_inner(text[used:], remainder, group_idx):
-                    yield used + rlen, r_idx
+    def _compile_sequence(self, pat: str, p: int, end: int, ast: list) -> int:
+        """
+        Append the nodes for the sequence pat[p:end] to `ast`; return its
+        start index. The pattern is addressed by index, never sliced.
+        """
+        start, prev = -1, -1
+        while p < end:
+            expr_type, expr_val, p, neg = self._parse_expression(pat, p, end)
+            quant = pat[p] if p < end and pat[p] in "+?*" else None
+            if quant:
+                p += 1
+
+            idx = len(ast)
+            ast.append(None)
+            if expr_type == "group":
+                self._group_counter += 1
+                group_no = self._group_counter
+                alts = tuple(self._compile_sequence(pat, alt_start, alt_end, ast)
+                             for alt_start, alt_end in expr_val)
+                ast[idx] = ["group", (group_no, alts), quant, None, -1]
+            else:
+                matcher = self._matcher_for(expr_type, expr_val, neg)
+                if expr_type == "class":
+                    expr_val = (expr_val, neg)
+                ast[idx] = [expr_type, expr_val, quant, matcher, -1]
+
+            if prev < 0:
+                start = idx
+            else:
+                ast[prev][4] = idx
+            prev = idx
+        return start
+
+    # ------------------------------------------------------------------
+    #  Literal prefilter
+    # ------------------------------------------------------------------
+    def _compile_literals(self):
+        """
+        Extract literal strings that every match must contain.
+
+        Walks the top-level sequence collecting runs of mandatory literal
+        characters; anything optional or variable ends the current run.
+        Returns (required, prefix, suffix): the runs, longest first, plus
+        the runs pinned to the start or end of the text by an anchor.
+        """
+        runs, prefix, suffix = [], "", ""
+        run, run_start, ni = [], -1, self._root
+        while ni >= 0:
+            atom_type, atom_val, quant, _, nxt = self._ast[ni]
+            mandatory = atom_type == "literal" and quant in (None, "+")
+            if mandatory:
+                if not run:
+                    run_start = ni
+                run.append(atom_val)
+            # 'a+' contributes one 'a', but more may follow before the next atom.
+            if run and (not mandatory or quant == "+" or nxt < 0):
+                literal = "".join(run)
+                runs.append(literal)
+                if self.anchored_start and run_start == self._root:
+                    prefix = literal
+                if self.anchored_end and mandatory and quant is None and nxt < 0:
+                    suffix = literal
+                run = []
+            ni = nxt
+        runs.sort(key=len, reverse=True)
+        return runs, prefix, suffix
+
+    # ------------------------------------------------------------------
+    #  Program compilation
+    # ------------------------------------------------------------------
+    def _compile_program(self, relaxed: bool = False) -> list:
+        """
+        Lower the AST into a flat program of (opcode, a, b) instructions,
+        following Cox's bytecode design:
+
+            _CHAR ch            consume one character equal to `ch`
+            _CLASS pred         consume one character accepted by `pred`
+            _GUARD pred         fail unless the next character passes `pred`
+            _JMP x              continue at x
+            _SPLIT x, y         try x first, then y
+            _SAVE slot          record the position in capture slot `slot`
+            _BACKREF g          consume the text captured by group g
+            _MARK r / _PROGRESS r
+                                remember the position in loop register r /
+                                fail unless the position has moved past it
+            _MATCH              succeed
+
+        The same program is run by the backtracking VM and, for patterns
+        without backreferences, by the Thompson NFA simulation.
+
+        With `relaxed`, every backreference is replaced by a copy of the
+        group it refers to, giving a regular superset of the pattern that
+        the NFA can run: text it rejects cannot match the pattern either.
+        """
+        prog = []
+        if relaxed:
+            self._relaxing, regs = Counter(), self._loop_regs
+        else:
+            self._node_pc = {}
+        self._emit_sequence(self._root, prog)
+        prog.append((_MATCH, None, None))
+        if relaxed:
+            self._relaxing, self._loop_regs = None, regs
+        return prog
+
+    def _emit_sequence(self, ni: int, prog: list):
+        while ni >= 0:
+            atom_type, atom_val, quant, matcher, nxt = self._ast[ni]
+            if self._relaxing is None:
+                self._node_pc[ni] = len(prog)
+            if atom_type == "group":
+                emit = lambda: self._emit_group(atom_val, matcher, prog)
+            elif atom_type == "backref" and self._relaxing is not None:
+                emit = lambda: self._emit_backref_superset(atom_val, prog)
+            elif atom_type == "backref":
+                emit = lambda: prog.append((_BACKREF, atom_val, None))
+            elif atom_type == "literal":
+                emit = lambda: prog.append((_CHAR, atom_val, None))
+            else:
+                emit = lambda: prog.append((_CLASS, matcher, None))
+            self._emit_repeat(prog, quant, emit, self._nullable(ni))
+            ni = nxt
+
+    def _emit_group(self, atom_val: tuple, guard, prog: list):
+        group_no, alts = atom_val
+        if guard is not None:
+            prog.append((_GUARD, guard, None))
+        prog.append((_SAVE, 2 * group_no - 2, None))
+        if self._relaxing is not None:
+            self._relaxing[group_no] += 1
+        jumps = []
+        for alt in alts[:-1]:
+            split = len(prog)
+            prog.append(None)
+            self._emit_sequence(alt, prog)
+            jumps.append(len(prog))
+            prog.append(None)
+            prog[split] = (_SPLIT, split + 1, len(prog))
+        self._emit_sequence(alts[-1], prog)
+        for jump in jumps:
+            prog[jump] = (_JMP, len(prog), None)
+        if self._relaxing is not None:
+            self._relaxing[group_no] -= 1
+        prog.append((_SAVE, 2 * group_no - 1, None))
+
+    def _emit_backref_superset(self, group_no: int, prog: list):
+        """
+        Emit a regular stand-in for a backreference: a copy of the group it
+        refers to, or any text at all if that group does not exist or is
+        still being emitted (a reference from inside itself).
+        """
+        nodes = [ni for ni, node in enumerate(self._ast)
+                 if node[0] == "group" and node[1][0] == group_no]
+        if not nodes or self._relaxing[group_no]:
+            top = len(prog)
+            prog.append((_SPLIT, top + 1, top + 3))
+            prog.append((_CLASS, lambda c: True, None))
+            prog.append((_JMP, top, None))
             return
+        _, atom_val, _, guard, _ = self._ast[nodes[0]]
+        self._emit_group(atom_val, guard, prog)
 
+    def _emit_repeat(self, prog: list, quant, emit_body, nullable: bool):
+        """
+        Emit `emit_body` under quantifier `quant`. A body that can match the
+        empty string is bracketed by _MARK/_PROGRESS so that another
+        repetition only starts after the previous one consumed input.
+        """
+        if quant is None:
+            emit_body()
+            return
         if quant == "?":
-            if text and matcher(text[0]):
-                for rlen, r_idx in self._match_inner(text[1:], remainder, group_idx):
-                    yield 1 + rlen, r_idx
-            for rlen, r_idx in self._match_inner(text, remainder, group_idx):
-                yield rlen, r_idx
+            split = len(prog)
+            prog.append(None)
+            emit_body()
+            prog[split] = (_SPLIT, split + 1, len(prog))
             return
 
-        if quant == "*":
-            reps = 0
-            while reps < len(text) and matcher(text[reps]):
-                reps += 1
-            for used in range(reps, -1, -1):
-                for rlen, r_idx in self._match_inner(text[used:], remainder, group_idx):
-                    yield used + rlen, r_idx
+        if not nullable:
+            top = len(prog)
+            if quant == "*":
+                prog.append(None)
+            emit_body()
+            if quant == "+":
+                prog.append((_SPLIT, top, len(prog) + 1))
+            else:
+                prog.append((_JMP, top, None))
+                prog[top] = (_SPLIT, top + 1, len(prog))
             return
 
+        reg = self._loop_base + self._loop_regs
+        self._loop_regs += 1
+        entry = len(prog)
+        if quant == "*":
+            prog.append(None)
+        top = len(prog)
+        prog.append((_MARK, reg, None))
+        emit_body()
+        split = len(prog)
+        prog.append(None)
+        prog.append((_PROGRESS, reg, None))
+        prog.append((_JMP, top, None))
+        prog[split] = (_SPLIT, split + 1, len(prog))
+        if quant == "*":
+            prog[entry] = (_SPLIT, entry + 1, len(prog))
+
+    def _nullable(self, ni: int, whole_sequence: bool = False) -> bool:
+        """
+        Whether node `ni` (or the sequence starting there) can match the
+        empty string. Backreferences may capture nothing, so count as such.
+        """
+        while ni >= 0:
+            atom_type, atom_val, quant, _, nxt = self._ast[ni]
+            if atom_type == "group":
+                empty = any(self._nullable(alt, True) for alt in atom_val[1])
+            else:
+                empty = atom_type == "backref"
+            if not (empty or quant in ("?", "*")):
+                return False
+            if not whole_sequence:
+                return True
+            ni = nxt
+        return True
+
+    def _compile_memo_flags(self) -> list:
+        """
+        Mark the program counters whose visits may be memoized.
+
+        From a pc that cannot reach a _BACKREF instruction the outcome
+        never depends on capture state, so once (pc, pos) has been explored
+        it need not be explored again. Every other pc is left unmemoized.
+        """
+        preds = [[] for _ in self._prog]
+        for pc, (op, a, b) in enumerate(self._prog):
+            if op == _JMP:
+                preds[a].append(pc)
+            elif op == _SPLIT:
+                preds[a].append(pc)
+                preds[b].append(pc)
+            elif op != _MATCH:
+                preds[pc + 1].append(pc)
+
+        memo_ok = [True] * len(self._prog)
+        pending = [pc for pc, ins in enumerate(self._prog) if ins[0] == _BACKREF]
+        while pending:
+            pc = pending.pop()
+            if memo_ok[pc]:
+                memo_ok[pc] = False
+                pending.extend(preds[pc])
+        return memo_ok
+
+    # ------------------------------------------------------------------
+    #  Thompson NFA simulation (patterns without backreferences)
+    # ------------------------------------------------------------------
+    def _nfa_matches(self, text: str, prog: list = None) -> bool:
+        """
+        Lockstep simulation of every thread of the program (by default the
+        pattern's own), in O(|program|·|text|). Only _CHAR and _CLASS
+        consume input; every other instruction is followed as an epsilon
+        edge.
+        """
+        prog = self._prog if prog is None else prog
+        anchored_start, anchored_end = self.anchored_start, self.anchored_end
+        size = len(prog)
+        clist, nlist = array("i", bytes(4 * size)), array("i", bytes(4 * size))
+        listid = array("i", [-1]) * size
+        stamp, ccount = 0, 0
+        stack = []
+
+        for i in range(len(text) + 1):
+            # Epsilon closure of the first instruction, added at every
+            # position unless the pattern is anchored to the start.
+            if i == 0 or not anchored_start:
+                stack.append(0)
+                ccount = self._nfa_closure(prog, stack, clist, ccount, listid, stamp)
+            elif not ccount:
+                return False
+
+            if i == len(text):
+                break
+
+            if not anchored_end:
+                for k in range(ccount):
+                    if prog[clist[k]][0] == _MATCH:
+                        return True
+
+            c = text[i]
+            stamp += 1
+            ncount = 0
+            for k in range(ccount):
+                op, a, _ = prog[clist[k]]
+                if op == _CHAR:
+                    if c != a:
+                        continue
+                elif op != _CLASS or not a(c):
+                    continue
+                stack.append(clist[k] + 1)
+                ncount = self._nfa_closure(prog, stack, nlist, ncount, listid, stamp)
+            clist, nlist, ccount = nlist, clist, ncount
+
+        for k in range(ccount):
+            if prog[clist[k]][0] == _MATCH:
+                return True
+        return False
+
+    @staticmethod
+    def _nfa_closure(prog: list, stack: list, states, count: int, listid, stamp: int) -> int:
+        """
+        Add the epsilon closure of the pcs on `stack` to `states`, skipping
+        pcs already stamped for this step. Returns the new state count.
+        """
+        while stack:
+            pc = stack.pop()
+            if listid[pc] == stamp:
+                continue
+            listid[pc] = stamp
+            op, a, b = prog[pc]
+            if op == _JMP:
+                stack.append(a)
+            elif op == _SPLIT:
+                stack.append(b)
+                stack.append(a)
+            elif op == _CHAR or op == _CLASS or op == _MATCH:
+                states[count] = pc
+                count += 1
+            else:
+                stack.append(pc + 1)
+        return count
+
+    # ------------------------------------------------------------------
+    #  Lazy DFA (patterns without backreferences)
+    # ------------------------------------------------------------------
+    def _dfa_matches(self, text: str):
+        """
+        Run the DFA obtained by subset construction over the program,
+        building states and transitions only as `text` reaches them.
+        Returns None if the DFA outgrew DFA_MAX_STATES and was abandoned.
+        """
+        if not self._dfa_sets:
+            self._dfa_state([0])
+        trans, accept, sets = self._dfa_trans, self._dfa_accept, self._dfa_sets
+        check = not self.anchored_end
+        state = 0
+        if check and accept[state]:
+            return True
+        for c in text:
+            nxt = trans[state].get(c)
+            if nxt is None:
+                nxt = self._dfa_step(state, c)
+                if nxt is None:
+                    return None
+            state = nxt
+            if not sets[state]:
+                return False
+            if check and accept[state]:
+                return True
+        return accept[state]
+
+    def _dfa_step(self, state: int, c: str):
+        """
+        Compute and cache the transition of `state` on `c`.
+        """
+        prog, pcs = self._prog, []
+        for pc in self._dfa_sets[state]:
+            op, a, _ = prog[pc]
+            if op == _CHAR:
+                if c == a:
+                    pcs.append(pc + 1)
+            elif op == _CLASS and a(c):
+                pcs.append(pc + 1)
+        if not self.anchored_start:
+            pcs.append(0)
+        nxt = self._dfa_state(pcs)
+        if nxt is not None:
+            self._dfa_trans[state][c] = nxt
+        return nxt
+
+    def _dfa_state(self, pcs: list):
+        """
+        Return the id of the DFA state for the epsilon closure of `pcs`,
+        adding it if new, or None after abandoning an oversized DFA.
+        """
+        size = len(self._prog)
+        states = array("i", bytes(4 * size))
+        count = self._nfa_closure(self._prog, pcs, states, 0, array("i", [-1]) * size, 0)
+        key = frozenset(states[:count])
+        state = self._dfa_ids.get(key)
+        if state is not None:
+            return state
+        if len(self._dfa_sets) >= self.DFA_MAX_STATES:
+            self._dfa_ids, self._dfa_sets, self._dfa_accept = {}, [], []
+            self._dfa_trans = None
+            return None
+        state = len(self._dfa_sets)
+        self._dfa_ids[key] = state
+        self._dfa_sets.append(tuple(key))
+        self._dfa_accept.append(any(self._prog[pc][0] == _MATCH for pc in key))
+        self._dfa_trans.append({})
+        return state
+
+    # ------------------------------------------------------------------
+    #  Backtracking VM
+    # ------------------------------------------------------------------
+    def _match_inner(self, text: str, pos: int) -> bool:
+        """
+        Run the program from `pos` with an explicit stack of pending
+        threads (pc, pos, undo_mark) instead of recursion, so long inputs
+        cannot exhaust Python's recursion limit.
+
+        Memoizable (pc, pos) pairs are recorded in `self._fail` on first
+        visit; reaching one again means it is already explored or being
+        explored, so the thread is dropped.
+        """
+        prog, memo_ok, visited = self._prog, self._memo_ok, self._fail
+        cap, undo, budget = self._cap, self._undo, self._budget
+        anchored_end = self.anchored_end
+        n = len(text)
+        width = n + 1
+        stack = [(0, pos, len(undo))]
+
+        while stack:
+            budget[0] -= 1
+            if budget[0] < 0:
+                raise _BudgetExceeded
+            pc, pos, mark = stack.pop()
+            self._rewind(mark)
+            while True:
+                if memo_ok[pc]:
+                    key = pc * width + pos
+                    if key in visited:
+                        break
+                    visited.add(key)
+                op, a, b = prog[pc]
+                if op == _CHAR:
+                    if pos < n and text[pos] == a:
+                        pc += 1
+                        pos += 1
+                        continue
+                    break
+                if op == _CLASS:
+                    if pos < n and a(text[pos]):
+                        pc += 1
+                        pos += 1
+                        continue
+                    break
+                if op == _SPLIT:
+                    stack.append((b, pos, len(undo)))
+                    pc = a
+                elif op == _JMP:
+                    pc = a
+                elif op == _SAVE or op == _MARK:
+                    undo.append((a, cap[a]))
+                    cap[a] = pos
+                    pc += 1
+                elif op == _GUARD:
+                    if pos >= n or not a(text[pos]):
+                        break
+                    pc += 1
+                elif op == _PROGRESS:
+                    if cap[a] == pos:
+                        break
+                    pc += 1
+                elif op == _BACKREF:
+                    start, end = cap[2 * a - 2], cap[2 * a - 1]
+                    if not 0 <= start <= end or not text.startswith(text[start:end], pos):
+                        break
+                    pos += end - start
+                    pc += 1
+                else:  # _MATCH
+                    if not anchored_end or pos == n:
+                        return True
+                    break
+        return False
+
+    # ------------------------------------------------------------------
+    #  Code generation
+    # ------------------------------------------------------------------
+    def _compile_codegen(self):
+        """
+        Specialize the pattern into straight-line Python and `exec` it once.
+
+        Every AST node becomes a function `_n<k>(t, n, i)` that returns True
+        if the node and everything after it match `t` (of length `n`) from
+        index `i`. Runs of unquantified atoms are fused into one function
+        testing all of them inline; quantified atoms become explicit greedy
+        loops; groups become `_open<g>`/`_close<g>` continuations that record
+        captures and undo them on failure. Returns the generated
+        `_search(t, starts)` function, which tries each start position in
+        turn.
+        """
+        lines = []
+        namespace = {"C": self._cap, "C0": self._cap_init, "F": set(),
+                     "B": self._budget, "X": _BudgetExceeded}
+        self._emit_code_sequence(self._root, "_accept", lines, namespace)
+
+        lines.append("def _accept(t, n, i):")
+        lines.append("    return i == n" if self.anchored_end else "    return True")
+        lines.append("def _search(t, starts):")
+        lines.append("    n = len(t)")
+        lines.append("    C[:] = C0")
+        lines.append("    F.clear()")
+        first = f"_n{self._root}" if self._root >= 0 else "_accept"
+        lines.append("    for i in starts:")
+        lines.append(f"        if {first}(t, n, i):")
+        lines.append("            return True")
+        lines.append("    return False")
+
+        exec("\n".join(lines), namespace)
+        return namespace["_search"]
+
+    def _emit_code_sequence(self, ni: int, end_fn: str, lines: list, namespace: dict):
+        """
+        Emit the functions for the sequence starting at `ni`; reaching its
+        end continues with `end_fn`.
+        """
+        ast = self._ast
+        while ni >= 0:
+            atom_type, atom_val, quant, matcher, nxt = ast[ni]
+            if atom_type in ("literal", "class", "escape", "wildcard") and quant is None:
+                # Fuse the run of unquantified single-character atoms.
+                run_start, tests = ni, []
+                while (ni >= 0 and ast[ni][2] is None and
+                       ast[ni][0] in ("literal", "class", "escape", "wildcard")):
+                    tests.append(ni)
+                    ni = ast[ni][4]
+                self._emit_code_run(run_start, tests, ni, end_fn, lines, namespace)
+                continue
+            after = f"_n{nxt}" if nxt >= 0 else end_fn
+            if atom_type == "group":
+                self._emit_code_group(ni, after, lines, namespace)
+            elif atom_type == "backref":
+                self._emit_code_backref(ni, after, lines)
+            else:
+                self._emit_code_repeat(ni, after, lines, namespace)
+            ni = nxt
+
+    def _code_test(self, ni: int, index: str, namespace: dict) -> str:
+        """
+        Return a Python expression testing node `ni` against t[index].
+        """
+        atom_type, atom_val, _, matcher, _ = self._ast[ni]
+        if atom_type == "literal":
+            return f"t[{index}] == {atom_val!r}"
+        if atom_type == "wildcard":
+            return "True"
+        namespace[f"P{ni}"] = matcher
+        return f"P{ni}(t[{index}])"
+
+    def _emit_code_run(self, run_start: int, tests: list, nxt: int, end_fn: str,
+                       lines: list, namespace: dict):
+        after = f"_n{nxt}" if nxt >= 0 else end_fn
+        conds, offset, literal = [f"i + {len(tests)} <= n"], 0, ""
+        for offset, ni in enumerate(tests + [None]):
+            if ni is not None and self._ast[ni][0] == "literal":
+                literal += self._ast[ni][1]
+                continue
+            at = offset - len(literal)
+            index = f"i + {at}" if at else "i"
+            if len(literal) > 1:
+                conds.append(f"t.startswith({literal!r}, {index})")
+            elif literal:
+                conds.append(f"t[{index}] == {literal!r}")
+            literal = ""
+            if ni is not None and self._ast[ni][0] != "wildcard":
+                index = f"i + {offset}" if offset else "i"
+                conds.append(self._code_test(ni, index, namespace))
+        lines.append(f"def _n{run_start}(t, n, i):")
+        lines.append(f"    if {' and '.join(conds)}:")
+        lines.append(f"        return {after}(t, n, i + {len(tests)})")
+        lines.append("    return False")
+
+    @staticmethod
+    def _code_budget_check() -> list:
+        """
+        Statements spending one step of the backtracking budget. They open
+        every unmemoized node and group entry, where the search can blow up.
+        """
+        return ["    B[0] -= 1", "    if B[0] < 0:", "        raise X"]
+
+    def _emit_code_memo(self, ni: int, lines: list):
+        """
+        Open a node function with its failure-memo check, if memoizable.
+        Returns the statements that record a failure before returning.
+        """
+        lines.append(f"def _n{ni}(t, n, i):")
+        if not self._memo_ok[self._node_pc[ni]]:
+            lines.extend(self._code_budget_check())
+            return ["    return False"]
+        lines.append(f"    key = i * {len(self._ast)} + {ni}")
+        lines.append("    if key in F:")
+        lines.append("        return False")
+        return ["    F.add(key)", "    return False"]
+
+    def _emit_code_repeat(self, ni: int, after: str, lines: list, namespace: dict):
+        quant = self._ast[ni][2]
+        fail = self._emit_code_memo(ni, lines)
+        test = self._code_test(ni, "i", namespace)
+        if quant == "?":
+            lines.append(f"    if i < n and {test} and {after}(t, n, i + 1):")
+            lines.append("        return True")
+            lines.append(f"    if {after}(t, n, i):")
+            lines.append("        return True")
+        else:
+            lowest = "i + 1" if quant == "+" else "i"
+            if self._ast[ni][0] == "wildcard":
+                lines.append("    j = n")
+            else:
+                run = self._code_run_scanner(ni)
+                if run is None:
+                    lines.append("    j = i")
+                else:
+                    namespace[f"R{ni}"] = run
+                    lines.append(f"    j = R{ni}(t, i).end()")
+                lines.append(f"    while j < n and {self._code_test(ni, 'j', namespace)}:")
+                lines.append("        j += 1")
+            lines.append(f"    while j >= {lowest}:")
+            lines.append(f"        if {after}(t, n, j):")
+            lines.append("            return True")
+            lines.append("        j -= 1")
+        lines.extend(fail)
+
+    def _code_run_scanner(self, ni: int):
+        """
+        Return a compiled `re` match function that consumes, in one C-level
+        scan, a run of characters node `ni` accepts, or None if `re` cannot
+        express the node. The scan may stop early on non-ASCII characters
+        that \\d and \\w accept; the caller continues the run character
+        by character from there.
+        """
+        atom_type, atom_val = self._ast[ni][0], self._ast[ni][1]
+        if atom_type == "literal":
+            run = re.escape(atom_val)
+        elif atom_type == "escape":
+            run = "[0-9]" if atom_val == "d" else "[0-9A-Za-z_]"
+        else:
+            run = self._translate_class(*atom_val)
+        try:
+            return re.compile(run + "*", re.DOTALL).match
+        except re.error:
+            return None
+
+    def _emit_code_backref(self, ni: int, after: str, lines: list):
+        """
+        Emit a backreference under its quantifier. The captured text does
+        not change while it repeats, so a greedy loop steps over whole
+        copies of it and backs off one copy at a time. An unset group
+        matches only zero repetitions, and an empty capture matches once.
+        """
+        group_no, quant = self._ast[ni][1], self._ast[ni][2]
+        if quant is None:
+            lines.append(f"def _n{ni}(t, n, i):")
+        else:
+            self._emit_code_memo(ni, lines)
+        lines.append(f"    s = C[{2 * group_no - 2}]")
+        lines.append(f"    e = C[{2 * group_no - 1}]")
+        if quant is None:
+            lines.append("    if 0 <= s <= e and t.startswith(t[s:e], i):")
+            lines.append(f"        return {after}(t, n, i + e - s)")
+            lines.append("    return False")
+        elif quant == "?":
+            lines.append("    if 0 <= s < e and t.startswith(t[s:e], i) and "
+                         f"{after}(t, n, i + e - s):")
+            lines.append("        return True")
+            lines.append(f"    return {after}(t, n, i)")
+        else:
+            lines.append("    if not 0 <= s <= e:")
+            lines.append(f"        return {after}(t, n, i)" if quant == "*"
+                         else "        return False")
+            lines.append("    w, sub, j = e - s, t[s:e], i")
+            lines.append("    if w:")
+            lines.append("        while t.startswith(sub, j):")
+            lines.append("            j += w")
+            lines.append(f"    while j >= {'i + w' if quant == '+' else 'i'}:")
+            lines.append(f"        if {after}(t, n, j):")
+            lines.append("            return True")
+            lines.append("        if not w:")
+            lines.append("            break")
+            lines.append("        j -= w")
+            lines.append("    return False")
+
+    def _emit_code_group(self, ni: int, after: str, lines: list, namespace: dict):
+        _, (group_no, alts), quant, guard, _ = self._ast[ni]
+        start, end = 2 * group_no - 2, 2 * group_no - 1
+        close = f"_close{group_no}"
+
+        fail = self._emit_code_memo(ni, lines)
+        lines.append(f"    if _open{group_no}(t, n, i):")
+        lines.append("        return True")
+        if quant in ("?", "*"):
+            lines.append(f"    if {after}(t, n, i):")
+            lines.append("        return True")
+        lines.extend(fail)
+
+        lines.append(f"def _open{group_no}(t, n, i):")
+        if not self._memo_ok[self._node_pc[ni]]:
+            lines.extend(self._code_budget_check())
+        if guard is not None:
+            namespace[f"G{group_no}"] = guard
+            lines.append(f"    if i >= n or not G{group_no}(t[i]):")
+            lines.append("        return False")
+        lines.append(f"    old = C[{start}]")
+        lines.append(f"    C[{start}] = i")
+        for alt in alts:
+            lines.append(f"    if {f'_n{alt}' if alt >= 0 else close}(t, n, i):")
+            lines.append("        return True")
+        lines.append(f"    C[{start}] = old")
+        lines.append("    return False")
+
+        lines.append(f"def {close}(t, n, i):")
+        lines.append(f"    old = C[{end}]")
+        lines.append(f"    C[{end}] = i")
+        if quant in ("+", "*"):
+            # Only repeat after the previous repetition consumed input.
+            lines.append(f"    if i > C[{start}] and _open{group_no}(t, n, i):")
+            lines.append("        return True")
+        lines.append(f"    if {after}(t, n, i):")
+        lines.append("        return True")
+        lines.append(f"    C[{end}] = old")
+        lines.append("    return False")
+
+        for alt in alts:
+            self._emit_code_sequence(alt, close, lines, namespace)
+
+    # ------------------------------------------------------------------
+    #  Capture table
+    # ------------------------------------------------------------------
+    def _rewind(self, mark: int):
+        cap, undo = self._cap, self._undo
+        while len(undo) > mark:
+            slot, value = undo.pop()
+            cap[slot] = value
+
+    @property
+    def captures(self) -> list:
+        if self._replay:
+            # The DFA and NFA only decide whether a match exists; rerun
+            # the accepted text once on the VM to recover its groups.
+            self._replay = False
+            self._budget[0] = sys.maxsize
+            self._vm_search(self._text)
+        cap, text = self._cap, self._text
+        return [text[cap[2 * g]:cap[2 * g + 1]]
+                if 0 <= cap[2 * g] <= cap[2 * g + 1] else None
+                for g in range(self.num_groups)]
+
     # ------------------------------------------------------------------
     #  Public API
     # ------------------------------------------------------------------
-    def _strip_anchors(self, pat: str):
-        start = pat.startswith("^")
-        end = pat.endswith("$")
-        core = pat[int(start):-int(end) or None]
-        return start, end, core
+    def _start_positions(self, text: str):
+        """
+        Yield the positions a backtracking search of `text` must try: each
+        occurrence of the pattern's literal prefix, or else each position
+        whose character is in the first-character set.
+        """
+        if self.anchored_start:
+            yield 0
+        elif self._lead:
+            i = text.find(self._lead)
+            while i >= 0:
+                yield i
+                i = text.find(self._lead, i + 1)
+        elif self._first_set is not None:
+            # A restricted first character means the match is never empty.
+            first = self._first_set
+            for i, c in enumerate(text):
+                if c >= "\x80" or first[ord(c)]:
+                    yield i
+        else:
+            yield from range(len(text) + 1)
+
+    @staticmethod
+    def _classifies_apart(text: str) -> bool:
+        """
+        Whether `text` has a character that `re` and str.isdigit/isalpha
+        may disagree on for \\d or \\w: a numeric character that is not
+        a decimal digit.
+        """
+        if text.isascii():
+            return False
+        for c in _NON_ASCII.findall(text):
+            if c.isnumeric() and not c.isdecimal():
+                return True
+        return False
 
     def matches(self, text: str) -> bool:
         """
         Public entry point: returns True if pattern matches text.
         """
-        anchored_start, anchored_end, core = self._strip_anchors(self.pattern)
-        self.captures = [None] * self.num_groups
+        # Cheap C-level literal scans reject most lines before matching.
+        if self._prefix and not text.startswith(self._prefix):
+            return False
+        if self._suffix and not text.endswith(self._suffix):
+            return False
+        for literal in self._required:
+            if literal not in text:
+                return False
 
-        if anchored_start:
-            gen = self._match_inner(text, core, 0)
-            if anchored_end:
-                return any(length == len(text) for length, _ in gen)
-            return next(gen, None) is not None
+        if self._compiled is not None and not (self._escape_gaps and
+                                               self._classifies_apart(text)):
+            found = self._compiled.search(text)
+            if found is None:
+                return False
+            # Group numbers carry over: backreferences are wrapped in (?:).
+            self._text, self._replay, cap = text, False, self._cap
+            for g in range(self.num_groups):
+                cap[2 * g], cap[2 * g + 1] = found.span(g + 1)
+            return True
+        # Without backreferences the pattern is regular and can be run as
+        # an NFA in linear time; otherwise fall back to backtracking.
+        if not self.num_backrefs:
+            result = self._dfa_matches(text) if self._dfa_trans is not None else None
+            if result is None:
+                result = self._nfa_matches(text)
+            if result:
+                self._text, self._replay = text, True
+            return result
 
-        for i in range(len(text) + 1):
-            gen = self._match_inner(text[i:], core, 0)
-            if anchored_end:
-                if any(i + length == len(text) for length, _ in gen):
-                    return True
-            else:
-                if next(gen, None) is not None:
-                    return True
+        self._text, self._replay = text, False
+        self._budget[0] = max(self.BACKTRACK_MIN_STEPS,
+                              self.BACKTRACK_STEPS_PER_CHAR * len(text))
+        try:
+            return self._backtrack(text)
+        except _BudgetExceeded:
+            pass
+        # The search may be exponential. If even the regular superset of
+        # the pattern fails, the NFA settles it in linear time; otherwise
+        # the backtracking search is rerun to completion.
+        self._cap[:] = self._cap_init
+        if not self._nfa_matches(text, self._relaxed):
+            return False
+        self._budget[0] = sys.maxsize
+        return self._backtrack(text)
+
+    def _backtrack(self, text: str) -> bool:
+        """
+        Search `text` with the generated matcher, or with the VM if the
+        generated code runs out of call stack.
+        """
+        try:
+            return self._matches(text, self._start_positions(text))
+        except RecursionError:
+            # Deeply nested continuations; the VM needs no call stack.
+            return self._vm_search(text)
+
+    def _vm_search(self, text: str) -> bool:
+        """
+        Search `text` with the bytecode VM from each start position.
+        """
+        # Reset captures in place; abandoned threads may leave values.
+        self._cap[:] = self._cap_init
+        self._undo.clear()
+        self._fail = set()
+
+        for i in self._start_positions(text):
+            if self._match_inner(text, i):
+                return True
+            self._rewind(0)
         return False
 
 
@@ -338,38 +1371,154 @@ class CLI:
     Handles input/output and command-line argument parsing.
     """
 
+    # Files at least this large are memory-mapped instead of read whole.
+    MMAP_THRESHOLD = 64 * 1024
+    # Recursive searches over at least this many files use a process pool,
+    # which is handed the files in batches of this size.
+    PARALLEL_MIN_FILES = 32
+    PARALLEL_BATCH = 16
+    # Matches are buffered and written to stdout in chunks of this size.
+    OUTPUT_CHUNK = 64 * 1024
+
     def __init__(self):
         self.pattern = None
         self.files = None
+        self.use_re = True
 
     def _parse_args(self):
         recursive = False
-        if len(sys.argv) >= 5 and sys.argv[1] == "-r" and sys.argv[2] == "-E":
-            return sys.argv[3], sys.argv[4], True
-        if len(sys.argv) < 3 or sys.argv[1] != "-E":
-            print("Usage: ./prog [-r] -E <pattern> [files...]")
+        argv = sys.argv
+        if len(argv) > 1 and argv[1] == "--mini":
+            # Opt out of the `re` backend and use the handcrafted engine.
+            self.use_re = False
+            argv = argv[:1] + argv[2:]
+        if len(argv) >= 5 and argv[1] == "-r" and argv[2] == "-E":
+            return argv[3], argv[4], True
+        if len(argv) < 3 or argv[1] != "-E":
+            print("Usage: ./prog [--mini] [-r] -E <pattern> [files...]")
             sys.exit(1)
-        return sys.argv[2], sys.argv[3:] if len(sys.argv) > 3 else None, False
+        return argv[2], argv[3:] if len(argv) > 3 else None, False
 
     def _read_stdin(self):
         text = sys.stdin.read()
         return text[:-1] if text.endswith("\n") else text
 
-    def _find_files_recursive(self, path: str, base: str, acc: list):
+    def _find_files_recursive(self, path: str, base: str):
+        """
+        Yield the regular files under `path`, relative to `base`, as the
+        directory walk reaches them. Symlinks are not followed.
+        """
         try:
-            for entry in os.listdir(path):
-                full = os.path.join(path, entry)
-                if os.path.isfile(full):
-                    acc.append(os.path.relpath(full, base))
-                elif os.path.isdir(full):
-                    self._find_files_recursive(full, base, acc)
+            it = os.scandir(path)
         except PermissionError:
-            pass
+            return
+        with it:
+            for entry in it:
+                try:
+                    if entry.is_file(follow_symlinks=False):
+                        yield os.path.relpath(entry.path, base)
+                    elif entry.is_dir(follow_symlinks=False):
+                        yield from self._find_files_recursive(entry.path, base)
+                except OSError:
+                    continue
+
+    @staticmethod
+    def _iter_lines(buf, literal: bytes = b""):
+        """
+        Yield (start, end) byte offsets of the lines in `buf`, excluding the
+        newline. When `literal` is given, jump straight to the lines that
+        contain it instead of visiting every line.
+        """
+        pos, size = 0, len(buf)
+        while pos < size:
+            if literal:
+                hit = buf.find(literal, pos)
+                if hit < 0:
+                    return
+                newline = buf.rfind(b"\n", pos, hit)
+                if newline >= 0:
+                    pos = newline + 1
+            end = buf.find(b"\n", pos)
+            if end < 0:
+                end = size
+            yield pos, end
+            pos = end + 1
+
+    @staticmethod
+    def _matching_lines(engine: MiniRegex, path: str):
+        """
+        Yield the raw bytes of each line of `path` that the engine matches,
+        including its newline if it had one. Large files are memory-mapped,
+        and lines are only decoded once they contain the pattern's longest
+        literal.
+
+        As in grep, only LF ends a line. A single CR before it is dropped so
+        CRLF files match as text, but a lone CR is part of the line, unlike
+        Python's universal-newline text mode.
+        """
+        with open(path, "rb") as f:
+            if os.fstat(f.fileno()).st_size >= CLI.MMAP_THRESHOLD:
+                buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                buf = f.read()
+        literal = engine.required_bytes[0] if engine.required_bytes else b""
+        try:
+            for start, end in CLI._iter_lines(buf, literal):
+                stop = end - 1 if end > start and buf[end - 1] == 13 else end
+                raw = buf[start:stop]
+                if engine.matches(raw.decode("utf-8", "replace")):
+                    yield raw + b"\n" if end < len(buf) else raw
+        finally:
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    def _scan_paths(self, engine: MiniRegex, base: str, paths):
+        """
+        Yield (rel, matching_lines) for every path, in order, as `paths`
+        streams in. Large trees are split across one worker process per
+        CPU, each of which builds its own engine from the pattern; only a
+        bounded window of batches is in flight, so the walk is never
+        drained ahead of the output.
+        """
+        paths = iter(paths)
+        head = list(islice(paths, self.PARALLEL_MIN_FILES))
+        workers = os.cpu_count() or 1
+        if workers > 1 and len(head) >= self.PARALLEL_MIN_FILES:
+            # Imported here: it pulls in multiprocessing, which small
+            # searches never need.
+            from concurrent.futures import ProcessPoolExecutor
+
+            paths = chain(head, paths)
+            with ProcessPoolExecutor(max_workers=workers,
+                                     initializer=_init_worker,
+                                     initargs=(self.pattern, self.use_re, base)) as pool:
+                window = deque()
+                for batch in iter(lambda: list(islice(paths, self.PARALLEL_BATCH)), []):
+                    window.append(pool.submit(_scan_batch, batch))
+                    if len(window) >= 4 * workers:
+                        yield from window.popleft().result()
+                while window:
+                    yield from window.popleft().result()
+            return
+        for rel in chain(head, paths):
+            yield rel, _scan_file(os.path.join(base, rel), engine)
+
+    @staticmethod
+    def _write_out(out: bytearray):
+        """
+        Write the output buffer straight to file descriptor 1 and empty it.
+        """
+        sys.stdout.flush()
+        written = 0
+        with memoryview(out) as view:
+            while written < len(out):
+                written += os.write(1, view[written:])
+        out.clear()
 
     def run(self):
         parsed = self._parse_args()
         self.pattern = parsed[0]
-        engine = MiniRegex(self.pattern)
+        engine = MiniRegex(self.pattern, use_re=self.use_re)
 
         # Recursive directory search
         if len(parsed) == 3 and parsed[2]:
@@ -380,37 +1529,41 @@ class CLI:
 
             abs_target = os.path.abspath(target_dir)
             base = os.path.dirname(abs_target) or "."
-            paths = []
-            self._find_files_recursive(abs_target, base, paths)
+            paths = self._find_files_recursive(abs_target, base)
 
+            out = bytearray()
             matched_any = False
-            for rel in paths:
-                full = os.path.join(base, rel)
-                try:
-                    with open(full, "r") as f:
-                        for line in f:
-                            stripped = line.rstrip("\n")
-                            if engine.matches(stripped):
-                                sys.stdout.write(f"{rel}:{stripped}\n")
-                                matched_any = True
-                except (IOError, PermissionError):
-                    continue
+            try:
+                for rel, lines in self._scan_paths(engine, base, paths):
+                    prefix = rel.encode() + b":"
+                    for line in lines:
+                        out += prefix
+                        out += line.rstrip(b"\n")
+                        out += b"\n"
+                        matched_any = True
+                    if len(out) > self.OUTPUT_CHUNK:
+                        self._write_out(out)
+            finally:
+                # Matches found before an error or interrupt still print.
+                self._write_out(out)
             sys.exit(0 if matched_any else 1)
 
         # Multiple file mode
         if isinstance(parsed[1], list) and parsed[1] is not None:
+            out = bytearray()
             matched_any = False
             self.files = parsed[1]
-            for fname in self.files:
-                with open(fname, "r") as f:
-                    for line in f:
-                        stripped = line.rstrip("\n")
-                        if engine.matches(stripped):
-                            if len(self.files) == 1:
-                                sys.stdout.write(line)
-                            else:
-                                sys.stdout.write(f"{fname}:{line}")
-                            matched_any = True
+            try:
+                for fname in self.files:
+                    prefix = b"" if len(self.files) == 1 else fname.encode() + b":"
+                    for line in self._matching_lines(engine, fname):
+                        out += prefix
+                        out += line
+                        matched_any = True
+                        if len(out) > self.OUTPUT_CHUNK:
+                            self._write_out(out)
+            finally:
+                self._write_out(out)
             sys.exit(0 if matched_any else 1)
 
         # Stdin single-line mode
@@ -424,6 +1577,40 @@ class CLI:
             sys.exit(1)
 
 
+# ----------------------------------------------------------------------
+#  Recursive search workers
+# ----------------------------------------------------------------------
+_worker_engine = None
+_worker_base = None
+
+
+def _init_worker(pattern: str, use_re: bool, base: str):
+    """
+    Build the engine once per worker process.
+    """
+    global _worker_engine, _worker_base
+    _worker_engine = MiniRegex(pattern, use_re=use_re)
+    _worker_base = base
+
+
+def _scan_file(path: str, engine: MiniRegex = None) -> list:
+    """
+    Return the matching lines of one file; unreadable files yield none.
+    """
+    try:
+        return list(CLI._matching_lines(engine or _worker_engine, path))
+    except (IOError, PermissionError):
+        return []
+
+
+def _scan_batch(rels: list) -> list:
+    """
+    Scan a batch of files of the tree in a worker; return each one with
+    its matching lines.
+    """
+    return [(rel, _scan_file(os.path.join(_worker_base, rel))) for rel in rels]
+
+
 # ======================================================================
 #  Entry Point
 # ======================================================================
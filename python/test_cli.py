@@ -0,0 +1,148 @@
+"""
+End-to-end tests for the command-line interface, run against files in a
+temporary directory.
+
+Run with:  python -m unittest test_cli   (from this directory)
+"""
+
+import os
+import subprocess
+import sys
+import tempfile
+import unittest
+
+from pygrep import CLI
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+SCRIPT = os.path.join(HERE, "pygrep.py")
+
+# Run the CLI with several CPUs reported, so large trees use the pool.
+POOLED = ("import os, sys; sys.path.insert(0, {here!r}); "
+          "os.cpu_count = lambda: 4; import pygrep; "
+          "sys.argv = ['pygrep.py'] + sys.argv[1:]; pygrep.CLI().run()")
+
+
+def run(*args, cwd, pooled=False):
+    if pooled:
+        command = [sys.executable, "-c", POOLED.format(here=HERE), *args]
+    else:
+        command = [sys.executable, SCRIPT, *args]
+    return subprocess.run(command, cwd=cwd, capture_output=True)
+
+
+class IterLinesTest(unittest.TestCase):
+    def test_spans(self):
+        buf = b"one\ntwo\n\nthree"
+        self.assertEqual(list(CLI._iter_lines(buf)),
+                         [(0, 3), (4, 7), (8, 8), (9, 14)])
+
+    def test_literal_jumps_to_candidate_lines(self):
+        buf = b"skip\nhas foo\nnope\nfoo again\nlast"
+        lines = [buf[s:e] for s, e in CLI._iter_lines(buf, b"foo")]
+        self.assertEqual(lines, [b"has foo", b"foo again"])
+
+    def test_literal_on_first_and_last_line(self):
+        buf = b"foo\nx\nfoo"
+        lines = [buf[s:e] for s, e in CLI._iter_lines(buf, b"foo")]
+        self.assertEqual(lines, [b"foo", b"foo"])
+
+
+class CLITest(unittest.TestCase):
+    def setUp(self):
+        self._tmp = tempfile.TemporaryDirectory()
+        self.dir = self._tmp.name
+
+    def tearDown(self):
+        self._tmp.cleanup()
+
+    def write(self, rel: str, data: bytes) -> str:
+        path = os.path.join(self.dir, rel)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(data)
+        return path
+
+    def test_single_file(self):
+        self.write("a.txt", b"foo\nbar\nfood\n")
+        result = run("-E", "fo+", "a.txt", cwd=self.dir)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, b"foo\nfood\n")
+
+    def test_no_match_exits_1(self):
+        self.write("a.txt", b"foo\n")
+        result = run("-E", "zzz", "a.txt", cwd=self.dir)
+        self.assertEqual(result.returncode, 1)
+        self.assertEqual(result.stdout, b"")
+
+    def test_multiple_files_are_prefixed(self):
+        self.write("a.txt", b"foo\nbar\n")
+        self.write("b.txt", b"bar\nfoo")
+        result = run("-E", "foo", "a.txt", "b.txt", cwd=self.dir)
+        self.assertEqual(result.stdout, b"a.txt:foo\nb.txt:foo")
+
+    def test_crlf_is_stripped(self):
+        self.write("a.txt", b"foo\r\nbar\r\n")
+        result = run("-E", "^foo$", "a.txt", cwd=self.dir)
+        self.assertEqual(result.stdout, b"foo\n")
+
+    def test_lone_cr_does_not_end_a_line(self):
+        self.write("a.txt", b"x\rfoo\nqux\r\r\n")
+        self.assertEqual(run("-E", "^foo$", "a.txt", cwd=self.dir).returncode, 1)
+        self.assertEqual(run("-E", "^qux$", "a.txt", cwd=self.dir).returncode, 1)
+        result = run("-E", "^qux.$", "a.txt", cwd=self.dir)
+        self.assertEqual(result.stdout, b"qux\r\n")
+
+    def test_invalid_utf8_is_printed_raw(self):
+        self.write("a.txt", b"x\xff\xfey\nxy\n")
+        result = run("-E", "x.*y", "a.txt", cwd=self.dir)
+        self.assertEqual(result.stdout, b"x\xff\xfey\nxy\n")
+
+    def test_mini_engine(self):
+        self.write("a.txt", b"abab\nabba\n")
+        result = run("--mini", "-E", "(ab)\\1", "a.txt", cwd=self.dir)
+        self.assertEqual(result.stdout, b"abab\n")
+
+    def test_memory_mapped_file(self):
+        filler = b"filler line\n" * (CLI.MMAP_THRESHOLD // 12 + 1)
+        self.write("big.txt", b"first hit\n" + filler + b"last hit")
+        result = run("-E", "hit", "big.txt", cwd=self.dir)
+        self.assertEqual(result.stdout, b"first hit\nlast hit")
+
+    def test_output_larger_than_a_chunk(self):
+        lines = [b"match %d" % i for i in range(CLI.OUTPUT_CHUNK // 5)]
+        self.write("a.txt", b"\n".join(lines) + b"\n")
+        result = run("-E", "match", "a.txt", cwd=self.dir)
+        self.assertEqual(result.stdout, b"\n".join(lines) + b"\n")
+
+    def test_recursive_walk(self):
+        self.write("tree/a.txt", b"foo\nbar\n")
+        self.write("tree/sub/b.txt", b"bar\nfoo\n")
+        self.write("tree/sub/c.txt", b"nothing\n")
+        os.symlink(os.path.join(self.dir, "tree", "a.txt"),
+                   os.path.join(self.dir, "tree", "sub", "link.txt"))
+        result = run("-r", "-E", "foo", "tree", cwd=self.dir)
+        self.assertEqual(result.returncode, 0)
+        self.assertEqual(sorted(result.stdout.splitlines()),
+                         [b"tree/a.txt:foo", b"tree/sub/b.txt:foo"])
+
+    def test_pooled_walk_matches_serial_walk(self):
+        count = CLI.PARALLEL_MIN_FILES + 3 * CLI.PARALLEL_BATCH
+        for i in range(count):
+            self.write(f"tree/d{i % 3}/f{i}.txt",
+                       b"foo %d\nbar\n" % i if i % 2 else b"bar\n")
+        serial = run("-r", "-E", "foo", "tree", cwd=self.dir)
+        pooled = run("-r", "-E", "foo", "tree", cwd=self.dir, pooled=True)
+        self.assertEqual(pooled.returncode, 0)
+        self.assertEqual(pooled.stdout, serial.stdout)
+        self.assertEqual(len(serial.stdout.splitlines()), count // 2)
+
+    def test_output_survives_a_later_error(self):
+        self.write("nonl.txt", b"foo no newline")
+        result = run("-E", "foo", "nonl.txt", "nosuch.txt", cwd=self.dir)
+        self.assertNotEqual(result.returncode, 0)
+        self.assertEqual(result.stdout, b"nonl.txt:foo no newline")
+        self.assertIn(b"FileNotFoundError", result.stderr)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,112 @@
+"""
+Regression tests for the matching engines.
+
+Every case runs through the `re` translation, the handcrafted engine
+(DFA/NFA or generated matcher) and the bytecode VM, which must agree.
+
+Run with:  python -m unittest test_pygrep   (from this directory)
+"""
+
+import sys
+import unittest
+
+from pygrep import MiniRegex
+
+CASES = [
+    # (pattern, text, expected)
+    ("abc", "xabcx", True),
+    ("^abc$", "abcx", False),
+    ("a+b", "caaab", True),
+    ("colou?r", "color", True),
+    ("[a-c]+x", "ccbx", True),
+    ("[^0-9]+$", "abc1", False),
+    ("\\d\\w+", "x9_a", True),
+    ("(cat|dog)s", "dogs", True),
+    ("^\\d$", "\u00b2", True),
+    ("^\\w$", "\u00bd", False),
+    ("^\\w+$", "na\u00efve", True),
+    ("(a|)+b", "aab", True),
+    ("^\\$", "$", True),
+    ("a\\$", "a", False),
+    ("^(\\w+) \\1$", "hey hey", True),
+    ("^(\\w+) \\1$", "hey hay", False),
+    ("(a)(b)?\\2", "ab", False),
+    # Quantified backreferences.
+    ("(a)\\1?b", "ab", True),
+    ("(a)\\1*b", "ab", True),
+    ("(a)x\\1*", "xax", True),
+    ("(a)\\1+b", "aab", True),
+    ("(a)\\1+b", "ab", False),
+    ("(a)\\1*aab", "aaaab", True),
+    ("(a*)\\1+b", "b", True),
+    ("(a)(c|d)+\\1?b", "acdb", True),
+    ("(a)(c|d)+\\1?b", "a" + "cd" * 3000 + "b", True),
+    ("(a)\\1[z-a]*", "aa", True),
+    ("(a)\\1[z-a]+", "aa", False),
+    # Patterns only the handcrafted engine accepts.
+    ("(x\\1?)y", "xy", True),
+    ("(x(\\1\\2))\\2", "xx", False),
+    ("(a(b\\1\\2)?)\\2", "abab", False),
+]
+
+
+def vm_matches(engine: MiniRegex, text: str) -> bool:
+    engine._text = text
+    engine._budget[0] = sys.maxsize
+    return engine._vm_search(text)
+
+
+class EngineAgreementTest(unittest.TestCase):
+    def test_re_backend(self):
+        for pattern, text, expected in CASES:
+            with self.subTest(pattern=pattern, text=text[:20]):
+                self.assertEqual(MiniRegex(pattern).matches(text), expected)
+
+    def test_captures(self):
+        cases = [
+            ("((a)(x)?)c", "zac", ["a", "a", None]),
+            ("(a|b)+c", "xabac", ["a"]),
+            ("(\\d+)\\.(\\d)", "v 10.5", ["10", "5"]),
+            ("(\\w+) \\1", "say hi hi", ["hi"]),
+        ]
+        for pattern, text, expected in cases:
+            for use_re in (True, False):
+                with self.subTest(pattern=pattern, use_re=use_re):
+                    engine = MiniRegex(pattern, use_re=use_re)
+                    self.assertTrue(engine.matches(text))
+                    self.assertEqual(engine.captures, expected)
+
+    def test_handcrafted_engine(self):
+        for pattern, text, expected in CASES:
+            with self.subTest(pattern=pattern, text=text[:20]):
+                engine = MiniRegex(pattern, use_re=False)
+                self.assertEqual(engine.matches(text), expected)
+
+    def test_vm(self):
+        for pattern, text, expected in CASES:
+            with self.subTest(pattern=pattern, text=text[:20]):
+                engine = MiniRegex(pattern, use_re=False)
+                self.assertEqual(vm_matches(engine, text), expected)
+
+    def test_exponential_search_fails_fast(self):
+        # Rejected by the regular superset once the budget runs out,
+        # rather than after exploring every way to split the a's.
+        engine = MiniRegex("^(a|a)*\\1c$", use_re=False)
+        self.assertFalse(engine.matches("a" * 22 + "bc"))
+
+    def test_budget_fallback(self):
+        # With no budget every backtracking search is first checked
+        # against the regular superset of the pattern.
+        old = MiniRegex.BACKTRACK_MIN_STEPS, MiniRegex.BACKTRACK_STEPS_PER_CHAR
+        MiniRegex.BACKTRACK_MIN_STEPS = MiniRegex.BACKTRACK_STEPS_PER_CHAR = 0
+        try:
+            for pattern, text, expected in CASES:
+                with self.subTest(pattern=pattern, text=text[:20]):
+                    engine = MiniRegex(pattern, use_re=False)
+                    self.assertEqual(engine.matches(text), expected)
+        finally:
+            MiniRegex.BACKTRACK_MIN_STEPS, MiniRegex.BACKTRACK_STEPS_PER_CHAR = old
+
+
+if __name__ == "__main__":
+    unittest.main()